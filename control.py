@@ -0,0 +1,242 @@
+"""External control channel: line-delimited JSON commands that drive the real game
+through the same code paths as mouse clicks, the U/R keys and the menu buttons.
+
+  request  {"id": 7, "cmd": "pick", "x": 2, "y": 0}
+  reply    {"id": 7, "ok": true, "result": {...}}
+           {"id": 7, "ok": false, "error": "..."}
+
+Commands:
+  start    [level] [seed]   menu Start button (optionally at `level`, with `seed`)
+  menu                      game-over "Back to Menu" button
+  pick     x y              click the top block of cell (x, y)
+  undo                      U key / Undo button
+  shuffle                   R key / Shuffle button
+  state                     full game state (same shape as a spectator snapshot)
+
+Lines are read and parsed on reader threads and replies written on writer threads.
+The game thread is woken with one CONTROL_EVENT per batch and runs every queued
+command, so a harness that pipelines requests is limited by the game logic rather
+than the frame rate.
+"""
+import json
+import queue
+import socket
+import sys
+import threading
+
+import pygame
+
+from handoff import Handoff
+
+
+CONTROL_EVENT = pygame.event.custom_type()
+
+# highest level `start` accepts; boards past this take seconds to deal
+MAX_START_LEVEL = 1000
+
+
+def _encode(msg):
+    return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class _Writer:
+    """Writes reply lines to a binary stream from its own thread, flushing per batch."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = queue.SimpleQueue()
+        threading.Thread(target=self._run, name='control-writer', daemon=True).start()
+
+    def put(self, line):
+        self.lines.put(line)
+
+    def close(self):
+        self.lines.put(None)
+
+    def _run(self):
+        lines = self.lines
+        try:
+            while True:
+                line = lines.get()
+                if line is None:
+                    break
+                self.stream.write(line)
+                if lines.empty():
+                    self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+class ControlChannel:
+    def __init__(self):
+        # (request, reply) pairs from the reader threads, drained on the game thread
+        self._pending = Handoff(self._post_wake)
+        self.handled = 0
+
+    def submit(self, line, reply):
+        """Queue one request line (any thread); `reply` gets the encoded reply line."""
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            reply(_encode({'ok': False, 'error': f"bad json: {e}"}))
+            return
+        if not isinstance(req, dict):
+            reply(_encode({'ok': False, 'error': "request must be a JSON object"}))
+            return
+        self._pending.put((req, reply))
+
+    @staticmethod
+    def _post_wake():
+        pygame.event.post(pygame.event.Event(CONTROL_EVENT))
+
+    def wake(self):
+        """Re-post the wakeup for commands already queued; setting the event filter
+        (Game.run) flushes the SDL queue, so one posted before the loop started is lost."""
+        self._pending.rewake()
+
+    def drain(self, game):
+        """Run every queued command against `game` (on the thread that owns it)."""
+        def run(item):
+            req, reply = item
+            reply(self.execute(game, req))
+            self.handled += 1
+        self._pending.drain(run)
+
+    def execute(self, game, req):
+        cmd = req.get('cmd')
+        handler = COMMANDS.get(cmd)
+        reply = {'ok': True}
+        if 'id' in req:
+            reply['id'] = req['id']
+        if handler is None:
+            reply.update(ok=False, error=f"unknown command {cmd!r}")
+            return _encode(reply)
+        try:
+            reply['result'] = handler(game, req)
+        except CommandError as e:
+            reply.update(ok=False, error=str(e))
+        except Exception as e:
+            # a bad command must never take the game loop down with it
+            reply.update(ok=False, error=f"{cmd} failed: {type(e).__name__}: {e}")
+        return _encode(reply)
+
+    # transports
+
+    def serve_stdin(self):
+        writer = _Writer(sys.stdout.buffer)
+        threading.Thread(target=self._read, args=(sys.stdin.buffer, writer), name='control-stdin',
+                         daemon=True).start()
+
+    def serve_tcp(self, port, host='127.0.0.1'):
+        server = socket.create_server((host, port))
+        threading.Thread(target=self._accept, args=(server,), name='control-accept', daemon=True).start()
+        return server
+
+    def _accept(self, server):
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            writer = _Writer(conn.makefile('wb'))
+            threading.Thread(target=self._read, args=(conn.makefile('rb'), writer), name='control-conn',
+                             daemon=True).start()
+
+    def _read(self, stream, writer):
+        try:
+            for line in stream:
+                if line.strip():
+                    self.submit(line, writer.put)
+        except (OSError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class CommandError(Exception):
+    pass
+
+
+def _summary(game):
+    return {'state': game.state, 'overlay': game.overlay(), 'level': game.level,
+            'score': game.score, 'preview': list(game.preview), 'remaining': game.remaining}
+
+
+def _check_input(game):
+    if game.input_blocked():
+        raise CommandError(f"input blocked by {game.overlay()} overlay")
+
+
+def cmd_start(game, req):
+    if game.state != 'menu':
+        raise CommandError(f"start needs the menu, state is {game.state!r}")
+    _check_input(game)
+    level = req.get('level')
+    seed = req.get('seed')
+    if level is not None and not (_is_int(level) and 1 <= level <= MAX_START_LEVEL):
+        raise CommandError(f"level must be an integer in 1..{MAX_START_LEVEL}")
+    if seed is not None and not _is_int(seed):
+        raise CommandError("seed must be an integer")
+    if level is not None:
+        game.level = level
+    game.press_start(seed=seed)
+    return dict(_summary(game), w=game.w, h=game.h, d=game.d, seed=game.seed)
+
+
+def cmd_menu(game, req):
+    _check_input(game)
+    if not game.back_to_menu():
+        raise CommandError(f"menu needs the game-over screen, state is {game.state!r}")
+    return _summary(game)
+
+
+def _is_int(value):
+    # JSON true/false arrive as bools, which are ints to Python
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def cmd_pick(game, req):
+    x, y = req.get('x'), req.get('y')
+    if not (_is_int(x) and _is_int(y) and 0 <= x < game.w and 0 <= y < game.h):
+        raise CommandError(f"x, y must be a cell inside the {game.w}x{game.h} board")
+    _check_input(game)
+    symbol = game.get_top(x, y)
+    before = len(game.preview)
+    moved = game.pick(x, y)
+    result = _summary(game)
+    result['moved'] = moved
+    if moved:
+        result['symbol'] = symbol
+        result['eliminated'] = (before + 1 - len(game.preview)) // 3
+    return result
+
+
+def cmd_undo(game, req):
+    _check_input(game)
+    applied = game.undo()
+    return dict(_summary(game), applied=applied)
+
+
+def cmd_shuffle(game, req):
+    _check_input(game)
+    applied = game.shuffle()
+    return dict(_summary(game), applied=applied)
+
+
+def cmd_state(game, req):
+    snap = game.spectator_snapshot()
+    del snap['t']
+    snap.update(seed=game.seed, can_undo='undo' in game.spec.features and bool(game.undo_stack),
+                can_shuffle='shuffle' in game.spec.features)
+    return snap
+
+
+COMMANDS = {
+    'start': cmd_start,
+    'menu': cmd_menu,
+    'pick': cmd_pick,
+    'undo': cmd_undo,
+    'shuffle': cmd_shuffle,
+    'state': cmd_state,
+}
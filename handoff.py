@@ -0,0 +1,37 @@
+"""Batched cross-thread handoff shared by the spectator stream and the control channel.
+
+Items are put from any thread and drained in order on the consuming thread, which
+is woken at most once per batch instead of once per item.
+"""
+from collections import deque
+
+
+class Handoff:
+    def __init__(self, wake):
+        """`wake()` asks the consuming thread to call drain(); it must be thread-safe."""
+        self._items = deque()
+        self._wake = wake
+        self._wake_pending = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        self._items.append(item)
+        if not self._wake_pending:
+            self._wake_pending = True
+            self._wake()
+
+    def rewake(self):
+        """Wake the consumer again for items already queued (its wakeup was lost)."""
+        if self._items:
+            self._wake_pending = True
+            self._wake()
+
+    def drain(self, handle):
+        """On the consuming thread: call `handle(item)` for everything queued."""
+        # clear the flag first so a put racing with this drain wakes the consumer again
+        self._wake_pending = False
+        items = self._items
+        while items:
+            handle(items.popleft())
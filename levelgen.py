@@ -0,0 +1,211 @@
+"""Batch level generation: deal many candidate boards for a level, score them with
+cheap per-layer metrics and keep the one at the level's target rank in that batch.
+
+The raw score range depends heavily on the board size (small boards are never
+easy, big ones never hard), so the difficulty curve is expressed as a rank within
+the candidates of the level rather than as an absolute score.
+
+A deal is a flat sequence of symbols laid out cell by cell, each cell holding `d`
+items bottom->top, i.e. cell i is deal[i * d:(i + 1) * d] and the top layer is
+deal[d - 1::d].
+"""
+import random
+from collections import Counter, OrderedDict
+from itertools import repeat
+from math import exp
+
+
+# weights of the two metrics in the combined difficulty score (both in 0..1)
+BURIAL_WEIGHT = 0.6
+OPEN_WEIGHT = 0.4
+
+# rough cap on symbols shuffled + scored per level; bounds generation time on big boards
+WORK_BUDGET = 20000
+
+
+def target_rank(level):
+    """Target position of `level`'s deal among its candidates, 0 = easiest, 1 = hardest.
+
+    Starts easy and levels off towards the 75th percentile.
+    """
+    return 0.15 + 0.6 * (1.0 - exp(-(level - 1) / 12.0))
+
+
+def layer_counts(deal, d):
+    """Symbol counts per layer, index 0 being the top (visible) layer."""
+    return [Counter(deal[d - 1 - k::d]) for k in range(d)]
+
+
+def open_ratio(top):
+    """Fraction of top tiles that belong to a triple which can be cleared right now."""
+    n_top = sum(top.values())
+    if n_top == 0:
+        return 1.0
+    return sum(c - c % 3 for c in top.values()) / n_top
+
+
+def burial_ratio(layers):
+    """How deep matching triples are buried, 0 = all on top, 1 = all at the bottom.
+
+    For each symbol the copies are taken shallowest first; every group of three is
+    scored by the depth of its deepest member.
+    """
+    d = len(layers)
+    if d <= 1:
+        return 0.0
+    symbols = set()
+    for layer in layers:
+        symbols.update(layer)
+    total = 0
+    triples = 0
+    for sym in symbols:
+        cum = 0
+        done = 0
+        for depth, layer in enumerate(layers):
+            cum += layer.get(sym, 0)
+            full = cum // 3
+            total += (full - done) * depth
+            done = full
+        triples += done
+    if triples == 0:
+        return 0.0
+    return total / (triples * (d - 1))
+
+
+def difficulty(deal, d):
+    layers = layer_counts(deal, d)
+    return BURIAL_WEIGHT * burial_ratio(layers) + OPEN_WEIGHT * (1.0 - open_ratio(layers[0]))
+
+
+def cycle_counts(order, n):
+    """How often each entry of `order` occurs in the first n items of its endless cycle."""
+    q, r = divmod(n, len(order))
+    return [q + (1 if i < r else 0) for i in range(len(order))]
+
+
+def deal_counts(total_blocks, top_slots, pool, extras):
+    """Number of tiles of each shape in `pool` dealt on a board of `total_blocks` tiles.
+
+    The board is made of triplets plus up to two leftovers. The distinct symbols are
+    taken by cycling `pool`; to keep playability when new shapes are introduced,
+    each occurrence of a new (`extras`) symbol gets a single triplet and the
+    remaining triplets go round the older/base symbols. Worked out from counts, so
+    the cost does not depend on the board size.
+    """
+    triplet_count, remainder = divmod(total_blocks, 3)
+    distinct = max(1, min(triplet_count, top_slots))
+    chosen = dict(zip(pool, cycle_counts(pool, distinct)))
+    extra_set = set(extras)
+    counts = dict.fromkeys(pool, 0)
+
+    # one triplet for each new symbol occurrence (so they appear but are rare)
+    new_pool = [s for s in pool if s in extra_set and chosen[s]]
+    base_pool = [s for s in pool if s not in extra_set and chosen[s]]
+    remaining_triplets = triplet_count
+    for sym in new_pool:
+        counts[sym] += 3 * chosen[sym]
+        remaining_triplets -= chosen[sym]
+
+    # distribute remaining triplets cyclically among base symbols if available, else new ones
+    target = base_pool or new_pool
+    if remaining_triplets > 0 and target:
+        n_target = sum(chosen[s] for s in target)
+        rounds, rest = divmod(remaining_triplets, n_target)
+        per_round = cycle_counts(target, n_target)
+        for sym, full, part in zip(target, per_round, cycle_counts(target, rest)):
+            counts[sym] += 3 * (rounds * full + part)
+
+    # leftover tiles continue the symbol cycle (no wildcards)
+    for j in range(remainder):
+        counts[pool[((triplet_count + j) % distinct) % len(pool)]] += 1
+    return counts
+
+
+def level_symbols(spec):
+    """Unshuffled multiset of symbols for a schedule LevelSpec, built in bulk."""
+    counts = deal_counts(spec.w * spec.h * spec.d, spec.w * spec.h, spec.shapes, spec.extras)
+    flat = []
+    for sym in spec.shapes:
+        flat.extend(repeat(sym, counts[sym]))
+    return flat
+
+
+class LevelGenerator:
+    """Picks the candidate deal at `target_rank` and caches it per (level, seed)."""
+
+    def __init__(self, candidates=64, cache_size=256):
+        self.candidates = candidates
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def deal(self, spec, seed):
+        """(deal, difficulty) for a schedule LevelSpec."""
+        return self.generate(spec.level, level_symbols(spec), spec.d, seed)
+
+    def generate(self, level, symbols, d, seed):
+        """Return (deal, difficulty) for the multiset `symbols` stacked `d` deep.
+
+        The same (level, seed) always yields the same deal. Boards too large to
+        score are dealt by shuffling `symbols` in place, with difficulty None.
+        """
+        key = (level, seed, len(symbols), d)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            return hit
+
+        n = min(self.candidates, WORK_BUDGET // max(1, len(symbols)))
+        if n <= 1:
+            # too big to score a batch: a single in-place shuffle, no copy and no cache
+            # (the seed still makes it reproducible)
+            random.Random(seed).shuffle(symbols)
+            return symbols, None
+
+        rng = random.Random(seed)
+        cand = list(symbols)
+        scored = []
+        for _ in range(n):
+            rng.shuffle(cand)
+            scored.append((difficulty(cand, d), tuple(cand)))
+        scored.sort(key=lambda c: c[0])
+        best_score, best = scored[round(target_rank(level) * (n - 1))]
+
+        result = (best, best_score)
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+
+class TileStream:
+    """Endless, reproducible supply of tiles for refilling the board in endless mode.
+
+    Tiles are dealt from shuffled bags made only of whole triples (shape mix from
+    `deal_counts`, so unlocked extras stay rare). Whatever has been dealt, plus what
+    is left of the current bag, is therefore a multiple of three of every symbol,
+    and only the current bag is ever held in memory.
+    """
+
+    def __init__(self, spec, seed, triples_per_shape=3):
+        pool = spec.shapes
+        n = len(pool) * triples_per_shape
+        self._counts = deal_counts(3 * n, len(pool), pool, spec.extras)
+        self._pool = pool
+        self._rng = random.Random(seed)
+        self._bag = []
+        self.dealt = 0
+
+    def take(self, n):
+        """The next `n` tiles."""
+        out = []
+        bag = self._bag
+        while len(out) < n:
+            if not bag:
+                for sym in self._pool:
+                    bag.extend(repeat(sym, self._counts[sym]))
+                self._rng.shuffle(bag)
+            k = min(n - len(out), len(bag))
+            out.extend(bag[-k:])
+            del bag[-k:]
+        self.dealt += n
+        return out
@@ -0,0 +1,240 @@
+"""Level packs: curated, pre-verified deals stored in one compact file that is
+opened with mmap, so loading level N only touches that level's record.
+
+Layout (little-endian):
+  header   magic b'M3PK', version u16, reserved u16, count u64,
+           index_offset u64, shapes_offset u64                      (32 bytes)
+  records  one per level, back to back:
+           level u32, seed u64, w u16, h u16, d u8, flags u8,
+           difficulty f32 (NaN if unknown)                          (22 bytes)
+           followed by w*h*d tile bytes, one shape-table index per tile,
+           cell by cell (x-major), bottom->top inside a cell
+  index    count u64 record offsets; entry i is level i + 1
+  shapes   n u16, then n x (len u8, utf-8 name)
+
+Build a pack from generated boards, or from boards checked elsewhere (one JSON
+object per line with level, w, h, d, deal, seed and optionally difficulty and
+verified):
+
+  python levelpack.py build pack.m3p --levels 500
+  python levelpack.py build pack.m3p --from boards.jsonl
+  python levelpack.py info pack.m3p
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+
+MAGIC = b'M3PK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQQ')
+RECORD = struct.Struct('<IQHHBBf')
+OFFSET = struct.Struct('<Q')
+
+# record flags
+FLAG_VERIFIED = 1
+
+PackRecord = namedtuple('PackRecord', 'level seed w h d verified difficulty deal')
+
+
+class LevelPack:
+    """Read-only view of a level pack; only the header and shape table are read on open."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path}: empty file is not a level pack")
+        if len(self._mm) < HEADER.size:
+            self.close()
+            raise ValueError(f"{path}: not a level pack")
+        magic, version, _, count, index_offset, shapes_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not a level pack")
+        if version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: unsupported level pack version {version}")
+        if index_offset + count * OFFSET.size > shapes_offset or shapes_offset + 2 > len(self._mm):
+            self.close()
+            raise ValueError(f"{path}: truncated level pack")
+        self.count = count
+        self._index = index_offset
+        self.shapes = self._read_shapes(shapes_offset)
+
+    def _read_shapes(self, offset):
+        mm = self._mm
+        (n,) = struct.unpack_from('<H', mm, offset)
+        pos = offset + 2
+        shapes = []
+        for _ in range(n):
+            size = mm[pos]
+            shapes.append(mm[pos + 1:pos + 1 + size].decode('utf-8'))
+            pos += 1 + size
+        return tuple(shapes)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        """Decode record `index` (0-based)."""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        mm = self._mm
+        (offset,) = OFFSET.unpack_from(mm, self._index + index * OFFSET.size)
+        level, seed, w, h, d, flags, difficulty = RECORD.unpack_from(mm, offset)
+        start = offset + RECORD.size
+        tiles = mm[start:start + w * h * d]
+        deal = list(map(self.shapes.__getitem__, tiles))
+        if difficulty != difficulty:  # NaN
+            difficulty = None
+        return PackRecord(level, seed, w, h, d, bool(flags & FLAG_VERIFIED), difficulty, deal)
+
+    def get(self, level):
+        """Record for `level` (1-based), or None if the pack does not cover it."""
+        if 1 <= level <= self.count:
+            return self.record(level - 1)
+        return None
+
+    def close(self):
+        mm = getattr(self, '_mm', None)
+        if mm is not None:
+            mm.close()
+            self._mm = None
+        self._file.close()
+
+
+class PackWriter:
+    """Streams records to a new pack file; memory use is 8 bytes per level for the index."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(bytes(HEADER.size))
+        self._offsets = array('Q')
+        self._shapes = {}
+
+    def add(self, level, w, h, d, deal, seed=0, difficulty=None, verified=False):
+        """Append the deal for `level`; levels must be added in order 1, 2, 3, ..."""
+        if level != len(self._offsets) + 1:
+            raise ValueError(f"expected level {len(self._offsets) + 1}, got {level}")
+        if len(deal) != w * h * d:
+            raise ValueError(f"level {level}: deal has {len(deal)} tiles, expected {w * h * d}")
+        shapes = self._shapes
+        for sym in set(deal):
+            if sym not in shapes:
+                if len(shapes) == 256:
+                    raise ValueError("a level pack holds at most 256 distinct shapes")
+                shapes[sym] = len(shapes)
+        self._offsets.append(self._file.tell())
+        self._file.write(RECORD.pack(level, seed, w, h, d, FLAG_VERIFIED if verified else 0,
+                                     float('nan') if difficulty is None else difficulty))
+        self._file.write(bytes(map(shapes.__getitem__, deal)))
+
+    def close(self):
+        f = self._file
+        index_offset = f.tell()
+        if sys.byteorder == 'big':
+            self._offsets.byteswap()
+        self._offsets.tofile(f)
+        shapes_offset = f.tell()
+        names = sorted(self._shapes, key=self._shapes.get)
+        f.write(struct.pack('<H', len(names)))
+        for name in names:
+            raw = name.encode('utf-8')
+            f.write(bytes([len(raw)]) + raw)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(self._offsets), index_offset, shapes_offset))
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """Discard the partial pack instead of finalising it."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def build_generated(path, levels, schedule, seed=0):
+    """Pack generator-picked deals for levels 1..levels."""
+    import random
+    from levelgen import LevelGenerator
+    generator = LevelGenerator(cache_size=0)
+    rng = random.Random(seed)
+    with PackWriter(path) as writer:
+        for level in range(1, levels + 1):
+            spec = schedule[level]
+            level_seed = rng.getrandbits(32)
+            deal, difficulty = generator.deal(spec, level_seed)
+            writer.add(level, spec.w, spec.h, spec.d, deal, seed=level_seed, difficulty=difficulty,
+                       verified=False)
+            if level % 1000 == 0:
+                print(f"  level {level}")
+
+
+def build_from_jsonl(path, source):
+    import json
+    with PackWriter(path) as writer, open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            b = json.loads(line)
+            writer.add(b['level'], b['w'], b['h'], b['d'], b['deal'], seed=b.get('seed', 0),
+                       difficulty=b.get('difficulty'), verified=b.get('verified', False))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or inspect level packs")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    build = sub.add_parser('build', help="write a level pack")
+    build.add_argument('out')
+    src = build.add_mutually_exclusive_group(required=True)
+    src.add_argument('--levels', type=int, metavar='N', help="generate deals for levels 1..N")
+    src.add_argument('--from', dest='source', metavar='JSONL', help="pack boards from a JSON-lines file")
+    build.add_argument('--seed', type=int, default=0, help="master seed for generated deals")
+    build.add_argument('--schedule', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels.json'),
+                       help="level schedule used for generated deals")
+    info = sub.add_parser('info', help="describe a level pack")
+    info.add_argument('pack')
+    info.add_argument('--level', type=int, help="also decode this level")
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'build':
+        if args.source:
+            build_from_jsonl(args.out, args.source)
+        else:
+            from schedule import LevelSchedule
+            build_generated(args.out, args.levels, LevelSchedule.load(args.schedule), seed=args.seed)
+        args.pack, args.level = args.out, None
+
+    pack = LevelPack(args.pack)
+    print(f"{args.pack}: {len(pack)} levels, {len(pack.shapes)} shapes, {os.path.getsize(args.pack)} bytes")
+    if args.level:
+        rec = pack.get(args.level)
+        if rec is None:
+            print(f"level {args.level} is not in this pack")
+        else:
+            print(f"level {rec.level}: {rec.w}x{rec.h}x{rec.d} seed={rec.seed} "
+                  f"verified={rec.verified} difficulty={rec.difficulty}")
+    pack.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,19 @@
+import os
 import sys
 import random
 import time
+# keep pygame's import banner off stdout, which carries replies for --control on stdin
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
 import pygame
-from math import floor
+from collections import namedtuple
+from itertools import product
+from math import ceil, floor
+
+from control import CONTROL_EVENT
+from levelgen import LevelGenerator, TileStream
+from schedule import LevelSchedule
+from levelpack import LevelPack
+from telemetry import Telemetry
 
 
 WINDOW_WIDTH = 800
@@ -10,42 +21,172 @@ WINDOW_HEIGHT = 800
 
 FPS = 30
 
+# level progression (see schedule.py), next to this file
+SCHEDULE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels.json')
+
 # UI layout ratios
 GRID_RATIO = 0.65  # top area fraction
 
 WILDCARD_COLOR = (255, 255, 255)
 
+# event types the game reacts to; everything else is blocked at the SDL queue
+INPUT_EVENTS = [pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, CONTROL_EVENT]
+# player input whose click-to-present latency is recorded (same rule in both run loops)
+LATENCY_EVENTS = (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN)
+
 
 def generate_colors(n):
     # kept for backward-compat but not used in symbol-based mode
     return []
 
 
-SHAPES = ['circle', 'triangle', 'square', 'diamond', 'pentagon', 'hexagon', 'cross', 'plus', 'oval', 'trapezoid']
-# extra shapes that will be introduced at higher levels
-EXTRA_SHAPES = ['four_star', 'five_star', 'hollow_circle']
+# everything draw() needs for one frame, detached from the live game state so it can be
+# handed to another thread (board tops/heights are flat tuples indexed x * h + y)
+Frame = namedtuple('Frame', 'state level w h d tops heights preview score remaining '
+                            'victory timesup hint can_undo can_shuffle best_level show_best endless rules')
+
+# endless mode ends when the preview holds this many tiles (about what fits on screen)
+ENDLESS_PREVIEW_LIMIT = 12
+
+
+class LatencyStats:
+    """Rolling window of input-to-present latencies (seconds) with percentile summaries."""
+
+    def __init__(self, size=512):
+        from collections import deque
+        self.samples = deque(maxlen=size)
+        self.count = 0
 
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
 
-def generate_shapes(n, pool=None):
-    """Generate a list of n shape names cycling through `pool` (defaults to SHAPES + EXTRA_SHAPES).
+    def percentile(self, p):
+        """Nearest-rank percentile in milliseconds (0.0 if nothing recorded yet)."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, ceil(p / 100.0 * len(ordered)) - 1))
+        return ordered[idx] * 1000.0
 
-    `pool` can be a subset to control which shapes are available at a given level.
+    def summary(self):
+        return "click->present p50 {:.1f}ms p90 {:.1f}ms p99 {:.1f}ms (n={})".format(
+            self.percentile(50), self.percentile(90), self.percentile(99), self.count)
+
+
+class QualityGovernor:
+    """Adjusts the rendering quality tier from measured frame times.
+
+    Steps down a tier after `down_after` frames whose smoothed cost is over
+    budget and back up after `up_after` frames with plenty of headroom. A step
+    up that is undone before it has lasted that long doubles the wait before
+    the next one (up to MAX_BACKOFF times), so a tier that is only just
+    affordable does not flap.
     """
-    if pool is None:
-        pool = SHAPES + EXTRA_SHAPES
-    syms = []
-    i = 0
-    while len(syms) < n:
-        syms.append(pool[i % len(pool)])
-        i += 1
-    return syms
+
+    MAX_BACKOFF = 64
+
+    TIERS = ['full', 'no halftone', 'simple cells', 'flat overlays']
+
+    def __init__(self, budget, down_after=10, up_after=90):
+        self.budget = budget
+        self.down_after = down_after
+        self.up_after = up_after
+        self.tier = 0
+        self.frame_time = 0.0  # smoothed (EMA) frame cost in seconds
+        self._over = 0
+        self._under = 0
+        self._up_wait = up_after  # current step-up delay, grows with backoff
+        self._since_up = None  # frames since the last step-up, until it has held
+
+    def record(self, seconds):
+        self.frame_time = seconds if not self.frame_time else self.frame_time * 0.9 + seconds * 0.1
+        if self.frame_time > self.budget * 0.9:
+            self._over += 1
+            self._under = 0
+        elif self.frame_time < self.budget * 0.5:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = 0
+            self._under = 0
+        if self._since_up is not None:
+            self._since_up += 1
+            if self._since_up >= self._up_wait:
+                # the step up held: back to the normal delay
+                self._since_up = None
+                self._up_wait = self.up_after
+        if self._over >= self.down_after and self.tier < len(self.TIERS) - 1:
+            self.tier += 1
+            self._over = 0
+            # the average still holds the old tier's cost; re-seed it from the next frame
+            self.frame_time = 0.0
+            if self._since_up is not None:
+                self._since_up = None
+                self._up_wait = min(self._up_wait * 2, self.up_after * self.MAX_BACKOFF)
+        elif self._under >= self._up_wait and self.tier > 0:
+            self.tier -= 1
+            self._under = 0
+            self.frame_time = 0.0
+            self._since_up = 0
+
+    def summary(self):
+        return f"quality tier {self.tier} ({self.TIERS[self.tier]}), frame {self.frame_time * 1000:.1f}ms"
+
+
+class SystemClock:
+    """Wall-clock time source for game logic.
+
+    `now` only changes when `sample()` is called (once per frame), so every timer
+    and overlay check within a frame sees the same instant.
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def sample(self):
+        self.now = time.time()
+        return self.now
+
+
+class ScaledClock(SystemClock):
+    """Real time running `scale` times faster (or slower) than the wall clock."""
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self._base = time.time()
+        self._t0 = time.perf_counter()
+        self.now = self._base
+
+    def sample(self):
+        self.now = self._base + (time.perf_counter() - self._t0) * self.scale
+        return self.now
+
+
+class ManualClock(SystemClock):
+    """Time that only moves when told to, for tests and simulations.
+
+    e.g. `clock.advance(101); game.update()` runs the level timer out instantly.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = float(start)
+
+    def sample(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+        return self.now
 
 
 class Game:
-    def __init__(self, screen):
+    def __init__(self, screen, clock=None, schedule=None, telemetry=None, pack=None, endless=False):
         pygame.font.init()
         self.screen = screen
         self.clock = pygame.time.Clock()
+        # time source for timers and overlays (SystemClock, ScaledClock or ManualClock)
+        self.sim_clock = clock if clock is not None else SystemClock()
         # Prefer common English UI fonts; reduce sizes slightly so popup text fits
         preferred_fonts = ["Segoe UI", "Arial", "Tahoma", None]
         chosen_small = None
@@ -68,6 +209,35 @@ class Game:
             self.font = chosen_small
             self.big_font = chosen_big
 
+        # spectator stream, off unless enable_spectators() is called
+        self.spectators = None
+        # external control channel, off unless enable_control() is called
+        self.control = None
+
+        # per-level gameplay counters (see telemetry.py); always collected, exported
+        # only when the Telemetry was given a directory
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.stats = None  # LevelStats of the level being played, set by start_level
+
+        # level progression table (see schedule.py / levels.json)
+        self.schedule = schedule if schedule is not None else LevelSchedule.load(SCHEDULE_FILE)
+        self._menu_rules = self.menu_rules()
+
+        # optional curated level pack (see levelpack.py); levels it covers skip the generator
+        self.pack = pack
+
+        # bumped whenever the board changes, so snapshot() can reuse tops/heights
+        self.board_version = 0
+        self._frame_board = None
+
+        # batch deal generator (see levelgen.py)
+        self.generator = LevelGenerator()
+
+        # endless mode: emptied cells are refilled from a TileStream instead of the level
+        # ending, and the score is the clearing rate in tiles per minute
+        self.endless = endless
+        self.tiles = None
+
         self.level = 1
         # game state: 'menu', 'playing', 'gameover'
         self.state = 'menu'
@@ -79,6 +249,12 @@ class Game:
         self.undo_stack = []
 
         self.running = True
+        # click-to-present latency, shown with F3 and printed on exit
+        self.latency = LatencyStats()
+        self.show_stats = False
+        # rendering quality tier, lowered automatically when frames run over budget
+        self.quality = QualityGovernor(1.0 / FPS)
+        self._overlays = {}
         # initialize audio (mixer) safely
         try:
             pygame.mixer.init(frequency=22050, size=-16, channels=1)
@@ -143,125 +319,50 @@ class Game:
         except Exception:
             self.best_level = 0
 
-    def start_level(self, level):
-        # compute dimensions based on level with max depth 3
-        # progression: start w=3,h=3,d=1; increase d up to 3, then alternate increasing h and w
+    def start_level(self, level, seed=None):
         self.level = level
-        # compute dims
-        base_w = 3
-        base_h = 3
-        d = 1
-        w = base_w
-        h = base_h
-        lvl = 1
-        # iterate levels to compute dims for requested level
-        while lvl < level:
-            if d < 3:
-                d += 1
-            else:
-                # alternate increasing h then w
-                if (h - base_h) <= (w - base_w):
-                    h += 1
-                else:
-                    w += 1
-            lvl += 1
-
+        # dimensions, shape pool, time limit and unlocks all come from the schedule table
+        spec = self.schedule[level]
+        self.spec = spec
+        if self.state == 'playing':
+            # the menu also builds (and, idling, restarts) a board; only real starts get
+            # a stats row, so menu boards never show up in the exports
+            self.stats = self.telemetry.level(level, endless=self.endless)
+            self.stats.starts += 1
+        record = self.pack.get(level) if self.pack is not None and not self.endless else None
+        if self.endless:
+            # board and refills come from one stream of whole triples; no undo, since
+            # snapshots would grow without bound and could not give refills back
+            spec = self.spec = spec._replace(features=spec.features - {'undo'})
+            w, h, d = spec.w, spec.h, spec.d
+            if seed is None:
+                seed = random.getrandbits(32)
+            self.tiles = TileStream(spec, seed)
+            deal, self.difficulty = self.tiles.take(w * h * d), None
+            self.tiles_cleared = 0
+        elif record is not None:
+            # curated, pre-verified deal from the level pack
+            w, h, d = record.w, record.h, record.d
+            seed = record.seed
+            deal, self.difficulty = record.deal, record.difficulty
+        else:
+            # deal the blocks: the generator shuffles a batch of candidates and keeps the
+            # one closest to this level's target difficulty (cached per level and seed)
+            w, h, d = spec.w, spec.h, spec.d
+            if seed is None:
+                seed = random.getrandbits(32)
+            deal, self.difficulty = self.generator.deal(spec, seed)
+        self.seed = seed
         self.w = w
         self.h = h
         self.d = d
         self.total_blocks = w * h * d
 
-        # generate blocks: make triplet_count and remainder
-        triplet_count = self.total_blocks // 3
-        remainder = self.total_blocks % 3
-
-        # control which shapes are available depending on level so we can introduce
-        # new shapes gradually (avoid making the game too hard immediately).
-        # Base pool is SHAPES; extras are added at specific levels.
-        pool = list(SHAPES)  # copy
-        if level >= 5:
-            pool.append('four_star')
-        if level >= 6:
-            pool.append('five_star')
-        if level >= 7:
-            pool.append('hollow_circle')
-
-        top_slots = w * h
-        distinct_symbols = max(1, min(triplet_count, top_slots))
-        symbols = generate_shapes(distinct_symbols, pool=pool)
-
-        # build flat list of symbols (triplets).
-        # To keep playability when introducing new shapes, make newly-introduced
-        # shapes rare initially: give each new shape a single triplet, then
-        # distribute remaining triplets among the older/base symbols.
-        flat = []
-        extra_set = set(EXTRA_SHAPES)
-        # identify which of the chosen symbols are extras (newly introduced)
-        new_symbols = [s for s in symbols if s in extra_set]
-        base_symbols = [s for s in symbols if s not in extra_set]
-
-        remaining_triplets = triplet_count
-        # assign one triplet for each new symbol (so they appear but are rare)
-        for sym in new_symbols:
-            flat.extend([sym, sym, sym])
-            remaining_triplets -= 1
-
-        # distribute remaining triplets among base symbols if available, else among new symbols
-        if base_symbols and remaining_triplets > 0:
-            for i in range(remaining_triplets):
-                sym = base_symbols[i % len(base_symbols)]
-                flat.extend([sym, sym, sym])
-        elif remaining_triplets > 0 and new_symbols:
-            for i in range(remaining_triplets):
-                sym = new_symbols[i % len(new_symbols)]
-                flat.extend([sym, sym, sym])
-
-        # append extra symbols for remainder (no wildcards)
-        offset = triplet_count
-        for j in range(remainder):
-            if flat:
-                # pick a symbol cyclically from the symbols list
-                sym = symbols[(offset + j) % len(symbols)]
-                flat.append(sym)
-            else:
-                flat.append(symbols[0])
-
-        # ensure total length equals total_blocks by adding the first symbol if needed
-        while len(flat) < self.total_blocks:
-            flat.append(symbols[0])
-        while len(flat) > self.total_blocks:
-            flat.pop()
-
-        random.shuffle(flat)
-
-        # prepare empty stacks as lists of length d filled with None
-        positions = [(x, y) for x in range(w) for y in range(h)]
-        random.shuffle(positions)
-        stacks = {pos: [None] * d for pos in positions}
-
-        # Randomly distribute all blocks (including wildcards) onto the board.
-        # First assign the top layer for every position from the shuffled flat list so white tiles
-        # can appear in the upper grid like other shapes.
-        for pos in positions:
-            if flat:
-                stacks[pos][-1] = flat.pop()
-            else:
-                stacks[pos][-1] = '*'
-
-        # Fill remaining lower slots (bottom-up) from the remaining flat list
-        for pos in positions:
-            stack = stacks[pos]
-            # fill indices 0 .. d-2 (if any)
-            for zi in range(d - 1):
-                if flat:
-                    stack[zi] = flat.pop()
-                else:
-                    stack[zi] = '*'
-
-        # convert stacks to board with bottom->top lists
-        self.board = {}
-        for pos in positions:
-            self.board[pos] = stacks[pos]
+        # cell (x, y) holds the next d items of the deal, bottom->top
+        self._cells = list(product(range(w), range(h)))
+        self.board = dict(zip(self._cells, map(list, zip(*[iter(deal)] * d))))
+        self.board_version += 1
+        del deal
 
         # preview area (list of symbols)
         self.preview = []
@@ -270,29 +371,30 @@ class Game:
         self.undo_stack = []
 
         # timer
-        self.level_time = 100  # seconds
-        self.level_start_ts = time.time()
+        self.level_time = spec.time_limit  # seconds
+        self.level_start_ts = self.now
 
         # score
         self.score = 0
+        # in endless mode the timer counts up instead
+        self.remaining = 0 if self.endless else self.level_time
 
         # feature hint popups: show only the first time each feature appears
-        if self.level == 2:
+        if spec.hint:
             self.hint_shown = True
-            self.hint_start = time.time()
-            self.hint_msg = "Undo unlocked: press U or click Undo to revert one step."
-        elif self.level == 3:
-            self.hint_shown = True
-            self.hint_start = time.time()
-            self.hint_msg = "Shuffle unlocked: press R or click Shuffle to reshuffle remaining blocks."
+            self.hint_start = self.now
+            self.hint_msg = spec.hint
         else:
             self.hint_shown = False
             self.hint_start = None
             self.hint_msg = ""
 
+        self._rules = self.level_rules()
+        self.publish_snapshot()
+
         # update best-level if higher
         try:
-            if level > self.best_level:
+            if level > self.best_level and not self.endless:
                 self.best_level = level
                 import json
                 with open(self.history_file, 'w', encoding='utf-8') as f:
@@ -300,6 +402,96 @@ class Game:
         except Exception:
             pass
 
+    def menu_rules(self):
+        """Start-screen rules text, worded from the level schedule."""
+        schedule = self.schedule
+        lines = [
+            "Click three identical shapes to remove them (match-3).",
+            "Clear all shapes to win the level.",
+        ]
+        if any('shape' in u for u in schedule.unlocks):
+            lines.append("More shapes will appear in later levels.")
+        _, _, depth, max_depth = schedule.board
+        grow = max_depth - depth
+        if 0 < grow <= 2:
+            lines.append('; '.join(f"Level {1 + k} adds a {depth + k}-layer stack" for k in range(1, grow + 1)) + '.')
+        elif grow > 2:
+            lines.append(f"Levels 2-{1 + grow} each add a stack layer, up to {max_depth} layers.")
+        lines.append("Try to clear all blocks within the time limit! (*^▽^*)")
+        return tuple(lines)
+
+    def level_rules(self):
+        """In-game rules text for the current level, worded from its schedule entry."""
+        lines = [
+            "Rules:",
+            "- Click a top block in the upper grid to move it to the preview area",
+            "- Only the last three items in preview (most recent 3) can be eliminated if identical",
+            "- Example: if preview ends with AAA then those three are removed",
+        ]
+        if self.endless:
+            lines.append(f"- No time limit; the run ends when the preview holds {ENDLESS_PREVIEW_LIMIT} tiles")
+        else:
+            seconds = self.spec.time_limit
+            if seconds % 60 == 0:
+                lines.append(f"- Time per level: {seconds // 60} minute{'s' if seconds != 60 else ''}")
+            else:
+                lines.append(f"- Time per level: {seconds} seconds")
+        if self.endless:
+            # only what this run's board has (never Undo, see start_level)
+            unlocks = [f"{f.capitalize()} available" for f in sorted(self.spec.features)]
+        else:
+            unlocks = [f"Level {u['level']} unlocks: {u['feature'].capitalize()}"
+                       for u in self.schedule.unlocks if 'feature' in u]
+        if unlocks:
+            lines.append("- " + '; '.join(unlocks))
+        return tuple(lines)
+
+    def enable_spectators(self, port=8765, host='127.0.0.1'):
+        """Start the spectator stream (see spectator.py) on host:port."""
+        from spectator import SpectatorServer
+        server = SpectatorServer(host=host, port=port)
+        server.start(self.spectator_snapshot())
+        self.spectators = server
+
+    def enable_control(self, port=None):
+        """Accept JSON-lines commands on stdin, or on 127.0.0.1:port (see control.py)."""
+        from control import ControlChannel
+        self.control = ControlChannel()
+        if port:
+            self.control.serve_tcp(port)
+        else:
+            self.control.serve_stdin()
+
+    def overlay(self):
+        if getattr(self, 'timesup_until', None):
+            return 'timesup'
+        if getattr(self, 'victory_until', None):
+            return 'victory'
+        return None
+
+    def spectator_snapshot(self):
+        cells = [(x, y) for x in range(self.w) for y in range(self.h)]
+        return {
+            't': 'snapshot', 'level': self.level, 'w': self.w, 'h': self.h, 'd': self.d,
+            'tops': [self.get_top(x, y) for x, y in cells],
+            'heights': [len(self.board.get(pos, [])) for pos in cells],
+            'preview': list(self.preview), 'score': self.score,
+            'remaining': self.remaining, 'state': self.state, 'overlay': self.overlay(),
+        }
+
+    def publish_snapshot(self):
+        if self.spectators:
+            self.spectators.publish(self.spectator_snapshot())
+
+    def publish_state(self):
+        if self.spectators:
+            self.spectators.publish({'t': 'state', 'state': self.state, 'overlay': self.overlay()})
+
+    @property
+    def now(self):
+        """Game time for the current frame (see SystemClock)."""
+        return self.sim_clock.now
+
     def get_top(self, x, y):
         stack = self.board.get((x, y), [])
         return stack[-1] if stack else None
@@ -307,7 +499,12 @@ class Game:
     def pop_top(self, x, y):
         stack = self.board.get((x, y), [])
         if stack:
-            return stack.pop()
+            self.board_version += 1
+            block = stack.pop()
+            if not stack and self.tiles is not None:
+                # endless mode: refill the emptied cell on demand
+                stack.extend(self.tiles.take(self.d))
+            return block
         return None
 
     def shuffle_remaining(self):
@@ -344,6 +541,7 @@ class Game:
         # Replace board while preserving any positions not in heights (unlikely)
         for pos in new_board:
             self.board[pos] = new_board[pos]
+        self.board_version += 1
 
     def all_cleared(self):
         return all(len(s) == 0 for s in self.board.values())
@@ -353,7 +551,7 @@ class Game:
 
         Returns True if any elimination happened (including cascades).
         """
-        eliminated_any = False
+        eliminated = 0
         # keep checking tail while possible
         while len(self.preview) >= 3:
             tail = self.preview[-3:]
@@ -362,7 +560,7 @@ class Game:
                 for _ in range(3):
                     self.preview.pop()
                 self.score += 10
-                eliminated_any = True
+                eliminated += 1
                 # play elimination sound
                 try:
                     if getattr(self, 'snd_elim', None):
@@ -380,7 +578,7 @@ class Game:
                 for _ in range(3):
                     self.preview.pop()
                 self.score += 10
-                eliminated_any = True
+                eliminated += 1
                 # play elimination sound
                 try:
                     if getattr(self, 'snd_elim', None):
@@ -392,26 +590,34 @@ class Game:
             # otherwise cannot eliminate the tail
             break
 
-        return eliminated_any
+        if eliminated:
+            self.stats.eliminations += eliminated
+            self.stats.cascades.observe(eliminated)
+        return eliminated > 0
 
     def handle_click(self, pos):
         mx, my = pos
         grid_h = int(WINDOW_HEIGHT * GRID_RATIO)
         if my > grid_h:
             # click in preview or UI area -> ignore for now
-            return
+            return False
         # map mx,my to grid x,y
         grid_w = WINDOW_WIDTH
         cell_w = grid_w // self.w
         cell_h = grid_h // self.h
         x = min(self.w - 1, mx // cell_w)
         y = min(self.h - 1, my // cell_h)
+        return self.pick(x, y)
+
+    def pick(self, x, y):
+        """Move the top block of cell (x, y) to the preview. Returns True if a block moved."""
         # only top is clickable
         top = self.get_top(x, y)
         if top is not None and self.state == 'playing':
             # push snapshot for undo
-            snap = (self._copy.deepcopy(self.board), list(self.preview), int(self.score), float(self.level_start_ts))
-            self.undo_stack.append(snap)
+            if 'undo' in self.spec.features:
+                snap = (self._copy.deepcopy(self.board), list(self.preview), int(self.score), float(self.level_start_ts))
+                self.undo_stack.append(snap)
             block = self.pop_top(x, y)
             # play click sound
             try:
@@ -419,44 +625,89 @@ class Game:
                     self.snd_click.play()
             except Exception:
                 pass
+            before = len(self.preview)
             self.preview.append(block)
+            stats = self.stats
+            stats.clicks += 1
+            if before + 1 > stats.preview_max:
+                stats.preview_max = before + 1
             # after adding, try eliminate
             self.try_eliminate_preview()
+            eliminated = (before + 1 - len(self.preview)) // 3
+            if self.endless:
+                self.tiles_cleared += 3 * eliminated
+                self.score = self.throughput()
+                if len(self.preview) >= ENDLESS_PREVIEW_LIMIT:
+                    self.state = 'gameover'
+                    stats.finish('preview_full', self.now - self.level_start_ts)
+            if self.spectators:
+                self.spectators.publish({
+                    't': 'move', 'x': x, 'y': y,
+                    'top': self.get_top(x, y), 'height': len(self.board.get((x, y), [])),
+                    'push': block, 'elim': eliminated, 'score': self.score,
+                })
 
             # check for all cleared but preview not empty -> game over
             if self.all_cleared() and len(self.preview) > 0:
                 self.state = 'gameover'
+                stats.finish('stuck', self.now - self.level_start_ts)
             # if everything cleared including preview -> victory for this level
             if self.all_cleared() and len(self.preview) == 0:
                 # set victory overlay for ~3 seconds then advance
-                self.victory_until = time.time() + 3.0
+                self.victory_until = self.now + 3.0
+                stats.finish('cleared', self.now - self.level_start_ts)
                 # play victory sound
                 try:
                     if getattr(self, 'snd_victory', None):
                         self.snd_victory.play()
                 except Exception:
                     pass
+            if self.state != 'playing' or getattr(self, 'victory_until', None):
+                self.publish_state()
+            return True
+        return False
+
+    def throughput(self):
+        """Endless-mode score: tiles cleared per minute since the run started."""
+        elapsed = max(1.0, self.now - self.level_start_ts)
+        return int(self.tiles_cleared * 60 / elapsed)
 
     def update(self):
+        self.telemetry.maybe_export(self.now)
+        if self.endless:
+            # no time limit and no victory; the clock counts up while playing
+            if self.state == 'playing':
+                elapsed = int(self.now - self.level_start_ts)
+                if self.spectators and elapsed != self.remaining:
+                    self.spectators.publish({'t': 'timer', 'remaining': elapsed})
+                self.remaining = elapsed
+                self.score = self.throughput()
+            return
         # check timer
-        elapsed = time.time() - self.level_start_ts
-        self.remaining = max(0, self.level_time - int(elapsed))
+        elapsed = self.now - self.level_start_ts
+        remaining = max(0, self.level_time - int(elapsed))
+        if self.spectators and remaining != getattr(self, 'remaining', None):
+            self.spectators.publish({'t': 'timer', 'remaining': remaining})
+        self.remaining = remaining
         if getattr(self, 'timesup_until', None):
             # if times-up overlay active, wait for it to expire and then restart level
-            if time.time() >= self.timesup_until:
+            if self.now >= self.timesup_until:
                 self.timesup_until = None
-                # restart same level
-                self.start_level(self.level)
+                # restart same level with the same deal
+                self.start_level(self.level, self.seed)
             return
 
         if self.remaining <= 0:
             # level failed: show a "Time's up!" overlay for a short moment then restart
             if not getattr(self, 'timesup_until', None):
-                self.timesup_until = time.time() + 3.0
+                self.timesup_until = self.now + 3.0
+                if self.state == 'playing':
+                    self.stats.finish('timeout', self.now - self.level_start_ts)
+                self.publish_state()
             return
         # if in victory overlay, wait until it's done
         if getattr(self, 'victory_until', None):
-            if time.time() >= self.victory_until:
+            if self.now >= self.victory_until:
                 self.victory_until = None
                 self.start_level(self.level + 1)
             return
@@ -464,23 +715,54 @@ class Game:
         # check win (catch cases where elimination finished game outside handle_click)
         if self.all_cleared() and len(self.preview) == 0:
             # set victory overlay and play sound
-            self.victory_until = time.time() + 3.0
+            self.victory_until = self.now + 3.0
+            self.stats.finish('cleared', self.now - self.level_start_ts)
+            self.publish_state()
             try:
                 if getattr(self, 'snd_victory', None):
                     self.snd_victory.play()
             except Exception:
                 pass
 
-    def draw(self):
+    def snapshot(self):
+        """Immutable Frame of everything draw() needs, taken at the current game time."""
+        cached = self._frame_board
+        if cached is None or cached[0] != self.board_version:
+            # board tops/heights only change with board_version, so reuse them between moves
+            stacks = [self.board.get(pos, ()) for pos in self._cells]
+            cached = (self.board_version, tuple(s[-1] if s else None for s in stacks), tuple(map(len, stacks)))
+            self._frame_board = cached
+        now = self.now
+        hint = self.hint_msg if self.hint_shown and now - self.hint_start < 4.0 else ''
+        showing_best = getattr(self, 'showing_best_until', None)
+        return Frame(
+            state=self.state, level=self.level, w=self.w, h=self.h, d=self.d,
+            tops=cached[1], heights=cached[2], preview=tuple(self.preview),
+            score=self.score, remaining=self.remaining,
+            victory=bool(getattr(self, 'victory_until', None)),
+            timesup=bool(getattr(self, 'timesup_until', None)),
+            hint=hint,
+            can_undo='undo' in self.spec.features and bool(self.undo_stack),
+            can_shuffle='shuffle' in self.spec.features,
+            best_level=self.best_level,
+            show_best=bool(showing_best) and now < showing_best,
+            endless=self.endless,
+            rules=self._menu_rules if self.state == 'menu' else self._rules,
+        )
+
+    def draw(self, frame):
+        """Render one Frame (see snapshot()); reads no game state directly."""
         self.screen.fill((200, 200, 200))
         # if in menu state, draw start screen
-        if self.state == 'menu':
+        if frame.state == 'menu':
             # comic-style black-and-white background with halftone dots
             self.screen.fill((245, 245, 245))
             # draw halftone-like dots pattern (sparse) for comic texture
+            # (decorative only, skipped from quality tier 1)
+            halftone = self.quality.tier < 1
             dot_color = (200, 200, 200)
             step = 10
-            for y in range(0, WINDOW_HEIGHT, step):
+            for y in range(0, WINDOW_HEIGHT, step) if halftone else ():
                 for x in range((y // step) % 2 * (step // 2), WINDOW_WIDTH, step):
                     if (x + y) % (step * 2) == 0:
                         pygame.draw.circle(self.screen, dot_color, (x + 3, y + 3), 2)
@@ -513,7 +795,7 @@ class Game:
                 dot_col = (200, 200, 200)
                 spacing = 12
                 maxr = min(w, h) * 0.45
-                for dx in range(0, w, spacing):
+                for dx in range(0, w, spacing) if halftone else ():
                     for dy in range(0, h, spacing):
                         px = dx + spacing // 2
                         py = dy + spacing // 2
@@ -564,42 +846,41 @@ class Game:
             pygame.draw.rect(self.screen, (60, 140, 60), best_btn.inflate(-6, -6))
             self.screen.blit(best_txt, (best_btn.left + (best_btn.width - best_txt.get_width()) // 2, best_btn.top + (best_btn.height - best_txt.get_height()) // 2))
 
-            # rules preview (below best button)
-            rules_preview = [
-                "Click three identical shapes to remove them (match-3).",
-                "Clear all shapes to win the level.",
-                "More shapes will appear in later levels.",
-                "Level 2 adds a 2-layer stack; Level 3 adds a 3-layer stack.",
-                "Try to clear all blocks within the time limit! (*^▽^*)",
-            ]
+            # rules preview (below best button), worded from the level schedule
+            rules_preview = frame.rules
             for i, line in enumerate(rules_preview):
                 txt = self.font.render(line, True, (10, 10, 10))
                 self.screen.blit(txt, ((WINDOW_WIDTH - txt.get_width()) // 2, best_btn.bottom + 12 + i * 20))
 
             # draw best-level popup if requested
-            if getattr(self, 'showing_best_until', None) and time.time() < self.showing_best_until:
+            if frame.show_best:
                 popup = pygame.Rect((WINDOW_WIDTH - 320) // 2, best_btn.bottom + 12 + len(rules_preview) * 20 + 12, 320, 48)
                 pygame.draw.rect(self.screen, (255, 255, 220), popup)
                 pygame.draw.rect(self.screen, (0, 0, 0), popup, 3)
-                best_msg = f"Highest level reached: {self.best_level}"
+                best_msg = f"Highest level reached: {frame.best_level}"
                 bt = self.font.render(best_msg, True, (0, 0, 0))
                 self.screen.blit(bt, (popup.left + (popup.width - bt.get_width()) // 2, popup.top + (popup.height - bt.get_height()) // 2))
+            self.draw_stats()
             pygame.display.flip()
             return
 
-        if self.state == 'gameover':
+        if frame.state == 'gameover':
             over = self.big_font.render("Game Over", True, (200, 20, 20))
             retry = self.big_font.render("Back to Menu", True, (255, 255, 255))
             self.screen.blit(over, ((WINDOW_WIDTH - over.get_width()) // 2, 120))
+            if frame.endless:
+                rate = self.font.render(f"{frame.score} tiles/min over {frame.remaining}s", True, (0, 0, 0))
+                self.screen.blit(rate, ((WINDOW_WIDTH - rate.get_width()) // 2, 170))
             btn_rect = pygame.Rect((WINDOW_WIDTH - 300) // 2, 220, 300, 60)
             pygame.draw.rect(self.screen, (200, 20, 20), btn_rect)
             self.screen.blit(retry, (btn_rect.left + (btn_rect.width - retry.get_width()) // 2, btn_rect.top + 12))
+            self.draw_stats()
             pygame.display.flip()
             return
         grid_h = int(WINDOW_HEIGHT * GRID_RATIO)
         grid_w = WINDOW_WIDTH
-        cell_w = grid_w // self.w
-        cell_h = grid_h // self.h
+        cell_w = grid_w // frame.w
+        cell_h = grid_h // frame.h
 
         def draw_block(surface, rect, item, sym_font=None):
             # item is a symbol string, '*' for wildcard
@@ -700,34 +981,43 @@ class Game:
                 pygame.draw.circle(surface, color, (int(cx), int(cy)), int(r))
                 pygame.draw.circle(surface, (0, 0, 0), (int(cx), int(cy)), int(r * 0.55))
             else:
-                # fallback: circle
+                # fallback: circle (schedule shapes are validated against schedule.SHAPES)
                 pygame.draw.circle(surface, color, (int(cx), int(cy)), int(r))
 
+        # from quality tier 2: no cell outlines, and no stack-size numbers on small cells
+        outlines = self.quality.tier < 2
+        counts = outlines or min(cell_w, cell_h) >= 48
         # draw grid (top-down: show top shape and count)
-        for x in range(self.w):
-            for y in range(self.h):
+        tops = frame.tops
+        heights = frame.heights
+        for x in range(frame.w):
+            for y in range(frame.h):
                 rx = x * cell_w
                 ry = y * cell_h
                 rect = pygame.Rect(rx + 2, ry + 2, cell_w - 4, cell_h - 4)
-                stack = self.board.get((x, y), [])
-                if stack:
-                    top = stack[-1]
+                height = heights[x * frame.h + y]
+                if height:
+                    top = tops[x * frame.h + y]
                     # top is a shape string or '*'
                     # draw background and shape
                     if top == '*':
                         # wildcard: white tile, no symbol
                         pygame.draw.rect(self.screen, (255, 255, 255), rect)
-                        pygame.draw.rect(self.screen, (40, 40, 40), rect, 2)
+                        if outlines:
+                            pygame.draw.rect(self.screen, (40, 40, 40), rect, 2)
                     else:
                         pygame.draw.rect(self.screen, (0, 0, 0), rect)
-                        pygame.draw.rect(self.screen, (40, 40, 40), rect, 2)
+                        if outlines:
+                            pygame.draw.rect(self.screen, (40, 40, 40), rect, 2)
                         draw_shape(self.screen, rect, top, (255, 255, 255))
                     # small text for stack size
-                    txt = self.font.render(str(len(stack)), True, (255, 255, 255) if top != '*' else (0, 0, 0))
-                    self.screen.blit(txt, (rx + 6, ry + 6))
+                    if counts:
+                        txt = self.font.render(str(height), True, (255, 255, 255) if top != '*' else (0, 0, 0))
+                        self.screen.blit(txt, (rx + 6, ry + 6))
                 else:
                     pygame.draw.rect(self.screen, (120, 120, 120), rect)
-                pygame.draw.rect(self.screen, (50, 50, 50), rect, 2)
+                if outlines:
+                    pygame.draw.rect(self.screen, (50, 50, 50), rect, 2)
 
         # draw divider
         pygame.draw.line(self.screen, (50, 50, 50), (0, grid_h), (WINDOW_WIDTH, grid_h), 4)
@@ -744,7 +1034,7 @@ class Game:
         pw = 48
         ph = 48
         gap = 8
-        for i, item in enumerate(self.preview):
+        for i, item in enumerate(frame.preview):
             r = pygame.Rect(px + i * (pw + gap), py, pw, ph)
             if item == '*':
                 pygame.draw.rect(self.screen, (255, 255, 255), r)
@@ -758,187 +1048,397 @@ class Game:
         ui_x = preview_rect.left + 10
         ui_y = py + ph + 12
         # make timer red when under 10 seconds to increase urgency
-        timer_color = (200, 20, 20) if getattr(self, 'remaining', 0) < 10 else (10, 10, 10)
-        timer_txt = self.big_font.render(f"Time: {self.remaining}s", True, timer_color)
-        level_txt = self.big_font.render(f"Level: {self.level} ({self.w}x{self.h}x{self.d})", True, (10, 10, 10))
-        score_txt = self.big_font.render(f"Score: {self.score}", True, (10, 10, 10))
+        if frame.endless:
+            timer_txt = self.big_font.render(f"Time: {frame.remaining}s", True, (10, 10, 10))
+            level_txt = self.big_font.render(f"Endless ({frame.w}x{frame.h}x{frame.d})", True, (10, 10, 10))
+            score_txt = self.big_font.render(f"Rate: {frame.score}/min", True, (10, 10, 10))
+        else:
+            timer_color = (200, 20, 20) if frame.remaining < 10 else (10, 10, 10)
+            timer_txt = self.big_font.render(f"Time: {frame.remaining}s", True, timer_color)
+            level_txt = self.big_font.render(f"Level: {frame.level} ({frame.w}x{frame.h}x{frame.d})", True, (10, 10, 10))
+            score_txt = self.big_font.render(f"Score: {frame.score}", True, (10, 10, 10))
         self.screen.blit(timer_txt, (ui_x, ui_y))
         self.screen.blit(level_txt, (ui_x + 220, ui_y))
         self.screen.blit(score_txt, (ui_x + 520, ui_y))
 
         # draw undo button
-        # draw undo button (unlocked from level 2)
+        # draw undo button (unlocked by the level schedule)
         undo_btn = pygame.Rect(preview_rect.right - 110, preview_rect.bottom - 50, 100, 36)
-        if self.level >= 2 and self.undo_stack:
+        if frame.can_undo:
             pygame.draw.rect(self.screen, (80, 160, 80), undo_btn)
         else:
             pygame.draw.rect(self.screen, (160, 160, 160), undo_btn)
         undo_txt = self.font.render("Undo (U)", True, (255, 255, 255))
         self.screen.blit(undo_txt, (undo_btn.left + 10, undo_btn.top + 8))
 
-        # draw shuffle (置换) button (unlocked from level 3)
+        # draw shuffle (置换) button (unlocked by the level schedule)
         shuffle_btn = pygame.Rect(preview_rect.right - 230, preview_rect.bottom - 50, 110, 36)
-        if self.level >= 3:
+        if frame.can_shuffle:
             pygame.draw.rect(self.screen, (100, 140, 200), shuffle_btn)
         else:
             pygame.draw.rect(self.screen, (160, 160, 160), shuffle_btn)
         sh_txt = self.font.render("Shuffle (R)", True, (255, 255, 255))
         self.screen.blit(sh_txt, (shuffle_btn.left + 10, shuffle_btn.top + 8))
 
-        # rules text
-        rules = [
-            "Rules:",
-            "- Click a top block in the upper grid to move it to the preview area",
-            "- Only the last three items in preview (most recent 3) can be eliminated if identical",
-            "- Example: if preview ends with AAA then those three are removed",
-            "- Time per level: 3 minutes",
-            "- Level 2 unlocks: Undo; Level 3 unlocks: Shuffle",
-        ]
-        for i, line in enumerate(rules):
+        # rules text (built from the schedule, see level_rules)
+        for i, line in enumerate(frame.rules):
             txt = self.font.render(line, True, (0, 0, 0))
             self.screen.blit(txt, (preview_rect.left + 10, ui_y + 50 + i * 22))
 
         # draw hint popup if needed (wrapped to avoid overflow)
-        if getattr(self, 'hint_shown', False):
-            if time.time() - self.hint_start < 4.0:
-                hint_rect = pygame.Rect((WINDOW_WIDTH - 560) // 2, 80, 560, 72)
-                pygame.draw.rect(self.screen, (255, 255, 200), hint_rect)
-                pygame.draw.rect(self.screen, (120, 120, 120), hint_rect, 2)
-
-                # render wrapped text to fit inside hint_rect with padding
-                def render_wrapped(surface, text, font, color, rect, padding=12, line_spacing=2):
-                    words = text.split()
-                    lines = []
-                    cur = ""
-                    max_width = rect.width - padding * 2
-                    for w in words:
-                        test = cur + (" " if cur else "") + w
-                        if font.size(test)[0] <= max_width:
-                            cur = test
-                        else:
-                            if cur:
-                                lines.append(cur)
-                            cur = w
-                    if cur:
-                        lines.append(cur)
-
-                    line_h = font.get_height()
-                    total_h = len(lines) * line_h + max(0, len(lines) - 1) * line_spacing
-                    y = rect.top + (rect.height - total_h) // 2
-                    for line in lines:
-                        txt_s = font.render(line, True, color)
-                        x = rect.left + (rect.width - txt_s.get_width()) // 2
-                        surface.blit(txt_s, (x, y))
-                        y += line_h + line_spacing
-
-                render_wrapped(self.screen, self.hint_msg, self.font, (0, 0, 0), hint_rect)
-            else:
-                self.hint_shown = False
+        if frame.hint:
+            hint_rect = pygame.Rect((WINDOW_WIDTH - 560) // 2, 80, 560, 72)
+            pygame.draw.rect(self.screen, (255, 255, 200), hint_rect)
+            pygame.draw.rect(self.screen, (120, 120, 120), hint_rect, 2)
+
+            # render wrapped text to fit inside hint_rect with padding
+            def render_wrapped(surface, text, font, color, rect, padding=12, line_spacing=2):
+                words = text.split()
+                lines = []
+                cur = ""
+                max_width = rect.width - padding * 2
+                for w in words:
+                    test = cur + (" " if cur else "") + w
+                    if font.size(test)[0] <= max_width:
+                        cur = test
+                    else:
+                        if cur:
+                            lines.append(cur)
+                        cur = w
+                if cur:
+                    lines.append(cur)
+
+                line_h = font.get_height()
+                total_h = len(lines) * line_h + max(0, len(lines) - 1) * line_spacing
+                y = rect.top + (rect.height - total_h) // 2
+                for line in lines:
+                    txt_s = font.render(line, True, color)
+                    x = rect.left + (rect.width - txt_s.get_width()) // 2
+                    surface.blit(txt_s, (x, y))
+                    y += line_h + line_spacing
+
+            render_wrapped(self.screen, frame.hint, self.font, (0, 0, 0), hint_rect)
 
         # draw victory overlay if active
-        if getattr(self, 'victory_until', None):
-            overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 160))
-            self.screen.blit(overlay, (0, 0))
+        if frame.victory:
+            self.draw_dim_overlay(160)
             msg = self.big_font.render("Congrats!", True, (255, 230, 100))
             sub = self.font.render("Advancing to next level...", True, (255, 255, 255))
             self.screen.blit(msg, ((WINDOW_WIDTH - msg.get_width()) // 2, (WINDOW_HEIGHT - msg.get_height()) // 2 - 10))
             self.screen.blit(sub, ((WINDOW_WIDTH - sub.get_width()) // 2, (WINDOW_HEIGHT - sub.get_height()) // 2 + 26))
         # draw times-up overlay if active (similar style to victory)
-        if getattr(self, 'timesup_until', None):
-            overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 200))
-            self.screen.blit(overlay, (0, 0))
+        if frame.timesup:
+            self.draw_dim_overlay(200)
             msg = self.big_font.render("Time's up!", True, (255, 200, 200))
             sub = self.font.render("Restarting level...", True, (255, 255, 255))
             self.screen.blit(msg, ((WINDOW_WIDTH - msg.get_width()) // 2, (WINDOW_HEIGHT - msg.get_height()) // 2 - 10))
             self.screen.blit(sub, ((WINDOW_WIDTH - sub.get_width()) // 2, (WINDOW_HEIGHT - sub.get_height()) // 2 + 26))
 
+        self.draw_stats()
         pygame.display.flip()
 
+    def draw_dim_overlay(self, alpha):
+        # darken the whole screen behind a popup; the surface is built once per alpha
+        # and uses surface alpha rather than per-pixel alpha. Quality tier 3 skips
+        # blending and just fills.
+        if self.quality.tier >= 3:
+            self.screen.fill((0, 0, 0))
+            return
+        overlay = self._overlays.get(alpha)
+        if overlay is None:
+            overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
+            overlay.set_alpha(alpha)
+            self._overlays[alpha] = overlay
+        self.screen.blit(overlay, (0, 0))
+
+    def draw_stats(self):
+        # instrumentation readout (toggle with F3)
+        if not self.show_stats:
+            return
+        lines = [
+            f"FPS: {self.clock.get_fps():.1f}",
+            self.latency.summary(),
+            self.quality.summary(),
+        ]
+        for i, line in enumerate(lines):
+            txt = self.font.render(line, True, (255, 255, 0))
+            bg = pygame.Rect(4, 4 + i * 22, txt.get_width() + 8, 22)
+            pygame.draw.rect(self.screen, (0, 0, 0), bg)
+            self.screen.blit(txt, (8, 6 + i * 22))
+
+    def press_start(self, seed=None):
+        """Menu Start button: begin playing the current level."""
+        if self.state != 'menu':
+            return False
+        self.state = 'playing'
+        self.start_level(self.level, seed)
+        return True
+
+    def back_to_menu(self):
+        """Game-over "Back to Menu" button."""
+        if self.state != 'gameover':
+            return False
+        self.state = 'menu'
+        self.publish_state()
+        return True
+
+    def input_blocked(self):
+        # input is ignored while the victory or times-up overlay is showing
+        return bool(getattr(self, 'victory_until', None) or getattr(self, 'timesup_until', None))
+
+    def undo(self):
+        """Revert the last move or shuffle. Returns True if a snapshot was restored."""
+        # Undo is unlocked by the level schedule (level 2 by default)
+        if self.state == 'playing' and 'undo' in self.spec.features and self.undo_stack:
+            board_snap, prev_snap, score_snap, ts_snap = self.undo_stack.pop()
+            self.board = board_snap
+            self.board_version += 1
+            self.preview = prev_snap
+            self.score = score_snap
+            self.level_start_ts = ts_snap
+            self.stats.undos += 1
+            self.publish_snapshot()
+            return True
+        return False
+
+    def shuffle(self):
+        """Shuffle the remaining blocks (undoable). Returns True if the board was shuffled."""
+        # Shuffle / 置换 is unlocked by the level schedule (level 3 by default)
+        if self.state == 'playing' and 'shuffle' in self.spec.features:
+            # push snapshot for undo (so shuffle itself can be undone)
+            if 'undo' in self.spec.features:
+                snap = (self._copy.deepcopy(self.board), list(self.preview), int(self.score), float(self.level_start_ts))
+                self.undo_stack.append(snap)
+            self.shuffle_remaining()
+            self.stats.shuffles += 1
+            self.publish_snapshot()
+            return True
+        return False
+
+    def handle_event(self, event):
+        """Apply a single input event. Returns True if it changed what is on screen."""
+        if event.type == pygame.QUIT:
+            self.running = False
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_F3:
+                # toggle the latency / instrumentation readout
+                self.show_stats = not self.show_stats
+                return True
+            # block input during victory or times-up overlay
+            if self.input_blocked():
+                return False
+            if event.key == pygame.K_ESCAPE:
+                self.running = False
+            elif event.key == pygame.K_u:
+                return self.undo()
+            elif event.key == pygame.K_r:
+                return self.shuffle()
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            # ignore mouse input during overlays
+            if self.input_blocked():
+                return False
+            mx, my = event.pos
+            # handle start/menu/gameover buttons
+            if self.state == 'menu':
+                btn_rect = pygame.Rect((WINDOW_WIDTH - 200) // 2, 220, 200, 60)
+                best_btn = pygame.Rect(btn_rect.left + (btn_rect.width - 120) // 2, btn_rect.bottom + 12, 120, 44)
+                if btn_rect.collidepoint(mx, my):
+                    return self.press_start()
+                elif best_btn.collidepoint(mx, my):
+                    # show best-level popup for 2.5 seconds
+                    self.showing_best_until = self.now + 2.5
+                    return True
+                return False
+            if self.state == 'gameover':
+                btn_rect = pygame.Rect((WINDOW_WIDTH - 300) // 2, 220, 300, 60)
+                if btn_rect.collidepoint(mx, my):
+                    return self.back_to_menu()
+                return False
+
+            # check undo button click
+            preview_top = int(WINDOW_HEIGHT * GRID_RATIO) + 10
+            preview_rect = pygame.Rect(10, preview_top, WINDOW_WIDTH - 20, WINDOW_HEIGHT - preview_top - 10)
+            undo_btn = pygame.Rect(preview_rect.right - 110, preview_rect.bottom - 50, 100, 36)
+            if undo_btn.collidepoint(mx, my):
+                return self.undo()
+
+            # check shuffle button click
+            shuffle_btn = pygame.Rect(preview_rect.right - 230, preview_rect.bottom - 50, 110, 36)
+            if shuffle_btn.collidepoint(mx, my):
+                return self.shuffle()
+
+            return self.handle_click(event.pos)
+        elif event.type == CONTROL_EVENT:
+            # commands from the external control channel (see control.py)
+            if self.control:
+                self.control.drain(self)
+        return False
+
+    def present(self, t_input, record=True):
+        """Run update/draw right away for an input that arrived at `t_input` (perf_counter)."""
+        self.update()
+        self.draw(self.snapshot())
+        if record:
+            self.latency.record(time.perf_counter() - t_input)
+
     def run(self):
+        # only let the event types we handle into the SDL queue; MOUSEMOTION and the
+        # window/touch/joystick chatter are dropped before they cost us anything
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(INPUT_EVENTS)
+        if self.control:
+            self.control.wake()
+        frame_budget = 1.0 / FPS
+        # events carry no arrival time, so input found in the queue is timed from the
+        # last moment the queue was seen empty (an upper bound on its latency)
+        last_poll = time.perf_counter()
         while self.running:
+            frame_start = time.perf_counter()
+            self.clock.tick()
+            self.sim_clock.sample()
+            # input that queued up while the previous frame was drawing
+            inputs = 0
             for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    # block input during victory or times-up overlay
-                    if getattr(self, 'victory_until', None) or getattr(self, 'timesup_until', None):
-                        continue
-                    if event.key == pygame.K_ESCAPE:
+                self.handle_event(event)
+                if event.type in LATENCY_EVENTS:
+                    inputs += 1
+            queued_since = last_poll
+            last_poll = time.perf_counter()
+            self.update()
+            self.draw(self.snapshot())
+            frame_end = time.perf_counter()
+            self.quality.record(frame_end - frame_start)
+            for _ in range(inputs):
+                self.latency.record(frame_end - queued_since)
+
+            # idle out the rest of the frame, but wake up for input so a move is
+            # applied and presented as soon as the click arrives instead of waiting
+            # for the next tick
+            deadline = frame_start + frame_budget
+            while self.running:
+                wait_ms = int((deadline - time.perf_counter()) * 1000)
+                if wait_ms <= 0:
+                    break
+                event = pygame.event.wait(wait_ms)
+                t_input = last_poll = time.perf_counter()
+                if event.type == pygame.NOEVENT:
+                    break
+                self.sim_clock.sample()
+                changed = self.handle_event(event)
+                if changed or event.type in LATENCY_EVENTS:
+                    self.present(t_input, record=event.type in LATENCY_EVENTS)
+
+    def run_threaded(self, tick_rate=60):
+        """Like run(), but the game state is owned by a SimulationThread ticking at
+        `tick_rate`. This thread only forwards input and draws the Frames it publishes,
+        so a slow draw never delays moves or timer checks."""
+        from simthread import SimulationThread
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(INPUT_EVENTS)
+        if self.control:
+            self.control.wake()
+        sim = SimulationThread(self, tick_rate)
+        sim.start()
+        frame_budget = 1.0 / FPS
+        last_poll = time.perf_counter()
+        try:
+            while self.running:
+                frame_start = time.perf_counter()
+                self.clock.tick()
+                inputs = seq = 0
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
                         self.running = False
-                    elif event.key == pygame.K_u:
-                        # undo key
-                        # Undo unlocked from level 2
-                        if self.state == 'playing' and self.level >= 2 and self.undo_stack:
-                            board_snap, prev_snap, score_snap, ts_snap = self.undo_stack.pop()
-                            self.board = board_snap
-                            self.preview = prev_snap
-                            self.score = score_snap
-                            self.level_start_ts = ts_snap
-                    elif event.key == pygame.K_r:
-                        # Shuffle / 置换 unlocked from level 3
-                        if self.state == 'playing' and self.level >= 3:
-                            # push snapshot for undo (so shuffle itself can be undone)
-                            snap = (self._copy.deepcopy(self.board), list(self.preview), int(self.score), float(self.level_start_ts))
-                            self.undo_stack.append(snap)
-                            self.shuffle_remaining()
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    # ignore mouse input during overlays
-                    if getattr(self, 'victory_until', None) or getattr(self, 'timesup_until', None):
-                        continue
-                    mx, my = event.pos
-                    # handle start/menu/gameover buttons
-                    if self.state == 'menu':
-                        btn_rect = pygame.Rect((WINDOW_WIDTH - 200) // 2, 220, 200, 60)
-                        best_btn = pygame.Rect(btn_rect.left + (btn_rect.width - 120) // 2, btn_rect.bottom + 12, 120, 44)
-                        if btn_rect.collidepoint(mx, my):
-                            self.state = 'playing'
-                            self.start_level(self.level)
-                        elif best_btn.collidepoint(mx, my):
-                            # show best-level popup for 2.5 seconds
-                            self.showing_best_until = time.time() + 2.5
-                        
-                        continue
-                    if self.state == 'gameover':
-                        btn_rect = pygame.Rect((WINDOW_WIDTH - 300) // 2, 220, 300, 60)
-                        if btn_rect.collidepoint(mx, my):
-                            self.state = 'menu'
-                        continue
-
-                    # check undo button click
-                    preview_top = int(WINDOW_HEIGHT * GRID_RATIO) + 10
-                    preview_rect = pygame.Rect(10, preview_top, WINDOW_WIDTH - 20, WINDOW_HEIGHT - preview_top - 10)
-                    undo_btn = pygame.Rect(preview_rect.right - 110, preview_rect.bottom - 50, 100, 36)
-                    if undo_btn.collidepoint(mx, my) and self.state == 'playing' and self.level >= 2 and self.undo_stack:
-                        board_snap, prev_snap, score_snap, ts_snap = self.undo_stack.pop()
-                        self.board = board_snap
-                        self.preview = prev_snap
-                        self.score = score_snap
-                        self.level_start_ts = ts_snap
-                        continue
-
-                    # check shuffle button click
-                    shuffle_btn = pygame.Rect(preview_rect.right - 230, preview_rect.bottom - 50, 110, 36)
-                    if shuffle_btn.collidepoint(mx, my) and self.state == 'playing' and self.level >= 3:
-                        snap = (self._copy.deepcopy(self.board), list(self.preview), int(self.score), float(self.level_start_ts))
-                        self.undo_stack.append(snap)
-                        self.shuffle_remaining()
+                    seq = sim.submit(event)
+                    if event.type in LATENCY_EVENTS:
+                        inputs += 1
+                queued_since = last_poll
+                last_poll = time.perf_counter()
+                # draw the frame that reflects the queued input, like the idle path below
+                self.draw(sim.wait_frame(seq, frame_budget) if inputs else sim.frame)
+                frame_end = time.perf_counter()
+                self.quality.record(frame_end - frame_start)
+                for _ in range(inputs):
+                    self.latency.record(frame_end - queued_since)
+
+                # idle out the frame; input is handed to the simulation as it arrives and
+                # the frame reflecting it is drawn as soon as it has been published
+                deadline = frame_start + frame_budget
+                while self.running:
+                    wait_ms = int((deadline - time.perf_counter()) * 1000)
+                    if wait_ms <= 0:
+                        break
+                    event = pygame.event.wait(wait_ms)
+                    t_input = last_poll = time.perf_counter()
+                    if event.type == pygame.NOEVENT:
+                        break
+                    if event.type == pygame.QUIT:
+                        self.running = False
+                        break
+                    if event.type not in LATENCY_EVENTS:
+                        # control commands reply on their own; shown with the next frame
+                        sim.submit(event)
                         continue
-
-                    self.handle_click(event.pos)
-
-            self.update()
-            self.draw()
-            self.clock.tick(FPS)
+                    frame = sim.wait_frame(sim.submit(event), frame_budget)
+                    self.draw(frame)
+                    self.latency.record(time.perf_counter() - t_input)
+        finally:
+            sim.stop()
+        if sim.error is not None:
+            raise sim.error
 
 
 def main():
+    import argparse
+
+    def positive_int(text):
+        value = int(text)
+        if value < 1:
+            raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+        return value
+
+    parser = argparse.ArgumentParser(description="3D Stack Match Demo")
+    parser.add_argument('--spectate', type=int, metavar='PORT',
+                        help="stream live game state to observers on 127.0.0.1:PORT")
+    parser.add_argument('--levels', default=SCHEDULE_FILE, metavar='PATH',
+                        help="level schedule file (default: levels.json)")
+    parser.add_argument('--pack', metavar='PATH',
+                        help="play curated deals from a level pack built with levelpack.py")
+    parser.add_argument('--metrics-dir', metavar='DIR',
+                        help="periodically write per-level metrics (Prometheus text file and JSON) to DIR")
+    parser.add_argument('--threaded-sim', type=int, nargs='?', const=60, metavar='HZ',
+                        help="run the game state on its own thread at HZ ticks per second (default 60)")
+    parser.add_argument('--control', nargs='?', const='stdin', metavar='PORT',
+                        help="accept JSON-lines control commands on stdin, or on 127.0.0.1:PORT")
+    parser.add_argument('--endless', type=positive_int, nargs='?', const=3, metavar='LEVEL',
+                        help="endless mode on LEVEL's board and shapes (default 3): emptied cells refill, "
+                             "score is tiles cleared per minute")
+    parser.add_argument('--time-scale', type=float, default=1.0, metavar='FACTOR',
+                        help="run level timers and overlays FACTOR times faster than real time")
+    args = parser.parse_args()
+
     pygame.init()
     screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
     pygame.display.set_caption("3D Stack Match Demo")
-    game = Game(screen)
-    game.run()
+    game = Game(screen, clock=ScaledClock(args.time_scale) if args.time_scale != 1.0 else None,
+                schedule=LevelSchedule.load(args.levels), telemetry=Telemetry(args.metrics_dir),
+                pack=LevelPack(args.pack) if args.pack else None, endless=bool(args.endless))
+    if args.endless:
+        game.level = args.endless
+    if args.spectate:
+        game.enable_spectators(port=args.spectate)
+    if args.control:
+        game.enable_control(port=None if args.control == 'stdin' else int(args.control))
+    if args.threaded_sim:
+        game.run_threaded(args.threaded_sim)
+    else:
+        game.run()
+    if game.spectators:
+        game.spectators.stop()
+    game.telemetry.export()
+    if game.latency.count:
+        # stdout belongs to the control channel when it runs on stdin
+        print(game.latency.summary(), file=sys.stderr if args.control == 'stdin' else sys.stdout)
     pygame.quit()
     sys.exit(0)
 
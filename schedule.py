@@ -0,0 +1,159 @@
+"""Level schedule: the level progression (board growth, shape pool, time limit and
+feature unlocks) read from a declarative JSON file (levels.json) and compiled
+once into a per-level lookup table.
+
+File format:
+  levels        number of levels compiled into the table (higher levels reuse the
+                last entry's settings with the board still growing)
+  board         width, height, depth of level 1 and max_depth; depth grows by one
+                per level up to max_depth, then height and width alternate
+  time_limit    seconds per level
+  time_limits   optional [{"from_level": n, "seconds": s}, ...] overrides, ascending
+  shapes        base shape pool, in dealing order (names from SHAPES)
+  unlocks       [{"level": n, "shape": name} | {"level": n, "feature": name, "hint": text}]
+                shapes unlocked here are dealt rarely at first; features are
+                'undo' and 'shuffle'
+"""
+import json
+from collections import namedtuple
+
+
+FEATURES = ('undo', 'shuffle')
+# shapes the game can draw (Game.draw_shape); anything else would render as a circle
+SHAPES = ('circle', 'square', 'triangle', 'diamond', 'pentagon', 'hexagon', 'cross', 'plus', 'oval',
+          'trapezoid', 'four_star', 'five_star', 'hollow_circle')
+
+# one compiled table row; `extras` are the unlocked (rare) shapes, `features` the
+# features available at this level and `hint` the popup text for what unlocks here
+LevelSpec = namedtuple('LevelSpec', 'level w h d shapes extras time_limit features hint')
+
+
+def level_dims(level, width=3, height=3, depth=1, max_depth=3):
+    """Board (w, h, d) for `level`, in constant time.
+
+    Progression: start at width x height x depth; increase d up to max_depth, then
+    alternate increasing h and w (h first) so the grid stays roughly square.
+    """
+    grow_depth = max_depth - depth
+    if level - 1 <= grow_depth:
+        return width, height, depth + max(0, level - 1)
+    k = level - 1 - grow_depth
+    return width + k // 2, height + (k + 1) // 2, max_depth
+
+
+class LevelSchedule:
+    def __init__(self, data, source='schedule'):
+        self.source = source
+        self._validate(data)
+        board = data['board']
+        self.board = (board['width'], board['height'], board['depth'], board['max_depth'])
+        self.time_limit = data['time_limit']
+        self.time_limits = [(t['from_level'], t['seconds']) for t in data.get('time_limits', [])]
+        self.shapes = list(data['shapes'])
+        self.unlocks = sorted(data.get('unlocks', []), key=lambda u: u['level'])
+        # compile the whole table up front; lookups are then plain indexing
+        self.table = []
+        shapes = list(self.shapes)
+        extras = []
+        features = set()
+        time_limit = self.time_limit
+        overrides = dict(self.time_limits)
+        unlocks = self.unlocks
+        u = 0
+        for level in range(1, data['levels'] + 1):
+            hints = []
+            while u < len(unlocks) and unlocks[u]['level'] == level:
+                entry = unlocks[u]
+                if 'shape' in entry:
+                    shapes.append(entry['shape'])
+                    extras.append(entry['shape'])
+                else:
+                    features.add(entry['feature'])
+                if entry.get('hint'):
+                    hints.append(entry['hint'])
+                u += 1
+            time_limit = overrides.get(level, time_limit)
+            w, h, d = level_dims(level, *self.board)
+            self.table.append(LevelSpec(level, w, h, d, tuple(shapes), frozenset(extras),
+                                        time_limit, frozenset(features), ' '.join(hints)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), source=path)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, level):
+        """LevelSpec for `level` (1-based)."""
+        if level < 1:
+            raise IndexError(f"level must be >= 1, got {level}")
+        if level <= len(self.table):
+            return self.table[level - 1]
+        # past the table: last entry's settings, board keeps growing
+        w, h, d = level_dims(level, *self.board)
+        return self.table[-1]._replace(level=level, w=w, h=h, d=d, hint='')
+
+    def _validate(self, data):
+        def fail(msg):
+            raise ValueError(f"{self.source}: {msg}")
+
+        def positive_int(value, what):
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                fail(f"{what} must be a positive integer, got {value!r}")
+
+        if not isinstance(data, dict):
+            fail("top level must be an object")
+        positive_int(data.get('levels'), 'levels')
+        levels = data['levels']
+
+        board = data.get('board')
+        if not isinstance(board, dict):
+            fail("board must be an object")
+        for key in ('width', 'height', 'depth', 'max_depth'):
+            positive_int(board.get(key), f"board.{key}")
+        if board['depth'] > board['max_depth']:
+            fail("board.depth must not exceed board.max_depth")
+
+        positive_int(data.get('time_limit'), 'time_limit')
+        last = 0
+        for i, entry in enumerate(data.get('time_limits', [])):
+            if not isinstance(entry, dict):
+                fail(f"time_limits[{i}] must be an object")
+            positive_int(entry.get('from_level'), f"time_limits[{i}].from_level")
+            positive_int(entry.get('seconds'), f"time_limits[{i}].seconds")
+            if entry['from_level'] <= last or entry['from_level'] > levels:
+                fail(f"time_limits[{i}].from_level must be ascending and within 1..{levels}")
+            last = entry['from_level']
+
+        shapes = data.get('shapes')
+        if not isinstance(shapes, list) or not shapes or not all(isinstance(s, str) and s for s in shapes):
+            fail("shapes must be a non-empty list of shape names")
+        seen = set()
+        for s in shapes:
+            if s in seen:
+                fail(f"shape {s!r} listed twice")
+            if s not in SHAPES:
+                fail(f"unknown shape {s!r} (known: {', '.join(SHAPES)})")
+            seen.add(s)
+
+        for i, entry in enumerate(data.get('unlocks', [])):
+            if not isinstance(entry, dict):
+                fail(f"unlocks[{i}] must be an object")
+            positive_int(entry.get('level'), f"unlocks[{i}].level")
+            if entry['level'] > levels:
+                fail(f"unlocks[{i}].level is past the last compiled level ({levels})")
+            if ('shape' in entry) == ('feature' in entry):
+                fail(f"unlocks[{i}] needs exactly one of 'shape' or 'feature'")
+            if 'shape' in entry:
+                s = entry['shape']
+                if not isinstance(s, str) or not s or s in seen:
+                    fail(f"unlocks[{i}].shape must be a new shape name, got {s!r}")
+                if s not in SHAPES:
+                    fail(f"unlocks[{i}].shape: unknown shape {s!r} (known: {', '.join(SHAPES)})")
+                seen.add(s)
+            elif entry['feature'] not in FEATURES:
+                fail(f"unlocks[{i}].feature must be one of {', '.join(FEATURES)}")
+            if not isinstance(entry.get('hint', ''), str):
+                fail(f"unlocks[{i}].hint must be a string")
@@ -0,0 +1,87 @@
+"""Simulation thread: owns the game state and ticks it at a fixed rate, while the
+render thread forwards input through a queue and draws the immutable Frames the
+simulation publishes (see Game.run_threaded)."""
+import queue
+import threading
+import time
+
+
+class SimulationThread(threading.Thread):
+    def __init__(self, game, tick_rate=60):
+        super().__init__(name='simulation', daemon=True)
+        self.game = game
+        self.period = 1.0 / tick_rate
+        self.commands = queue.SimpleQueue()
+        # latest published Frame; replaced wholesale, never mutated
+        self.frame = game.snapshot()
+        self.submitted = 0  # commands handed over (render thread)
+        self.applied = 0  # commands reflected in self.frame (simulation thread)
+        self.running = True
+        # exception that ended the simulation, re-raised by Game.run_threaded
+        self.error = None
+        self._published = threading.Condition()
+
+    def submit(self, event):
+        """Queue an input event for the simulation; returns its sequence number."""
+        self.submitted += 1
+        self.commands.put(event)
+        return self.submitted
+
+    def wait_frame(self, seq, timeout):
+        """Latest Frame, waiting up to `timeout` seconds for command `seq` to be applied."""
+        with self._published:
+            self._published.wait_for(lambda: self.applied >= seq or not self.running, timeout)
+            return self.frame
+
+    def stop(self):
+        self.running = False
+        self.commands.put(None)  # wake the loop
+        self.join(1.0)
+
+    def run(self):
+        game = self.game
+        commands = self.commands
+        next_tick = time.perf_counter()
+        try:
+            while self.running and game.running:
+                # sleep until the next tick, but wake up for commands so moves are
+                # applied and published right away
+                timeout = next_tick - time.perf_counter()
+                try:
+                    event = commands.get(timeout=timeout) if timeout > 0 else commands.get_nowait()
+                except queue.Empty:
+                    event = None
+                game.sim_clock.sample()
+                applied = 0
+                while event is not None:
+                    game.handle_event(event)
+                    applied += 1
+                    try:
+                        event = commands.get_nowait()
+                    except queue.Empty:
+                        event = None
+                now = time.perf_counter()
+                if now >= next_tick:
+                    game.update()
+                    next_tick += self.period
+                    if next_tick < now:
+                        # fell behind (e.g. a long level start): skip ticks, don't spiral
+                        next_tick = now + self.period
+                elif not applied:
+                    continue
+                self._publish(applied)
+        except BaseException as e:
+            self.error = e
+            # stop the render loop too, it has nothing left to draw
+            game.running = False
+        finally:
+            self.running = False
+            with self._published:
+                self._published.notify_all()
+
+    def _publish(self, applied):
+        frame = self.game.snapshot()
+        with self._published:
+            self.frame = frame
+            self.applied += applied
+            self._published.notify_all()
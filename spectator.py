@@ -0,0 +1,153 @@
+"""Optional spectator stream: an asyncio server on a local socket that lets other
+processes watch a live game.
+
+Observers get a full snapshot on connect and then one small JSON line per change
+(move, timer, state). The server runs its own event loop on a daemon thread; the
+game thread only hands messages over with `publish`, so a slow or stuck observer
+never blocks the game loop. Each observer has a bounded queue; when it fills up
+the backlog is dropped and replaced with a fresh snapshot.
+
+Message types (one JSON object per line):
+  snapshot  level, w, h, d, tops, heights, preview, score, remaining, state, overlay
+            (tops/heights are flat lists indexed x * h + y)
+  move      x, y, top, height, push, elim, score
+  timer     remaining
+  state     state, overlay
+"""
+import asyncio
+import json
+import sys
+import threading
+
+from handoff import Handoff
+
+
+class _Observer:
+    def __init__(self, writer, queue):
+        self.writer = writer
+        self.queue = queue
+        self.resyncs = 0
+
+
+class SpectatorServer:
+    def __init__(self, host='127.0.0.1', port=8765, queue_size=256):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.loop = None
+        self.thread = None
+        self.observers = set()
+        # mirror of what observers can see, kept up to date from published deltas
+        self.view = None
+        self._snapshot_line = None
+        self._ready = threading.Event()
+        # messages handed over by the game thread, drained on the loop thread
+        self._pending = Handoff(self._wake)
+
+    def start(self, snapshot):
+        """Start serving on a background thread; `snapshot` is the current game view."""
+        self.view = snapshot
+        self.thread = threading.Thread(target=self._run, name='spectator', daemon=True)
+        self.thread.start()
+        self._ready.wait(5.0)
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(2.0)
+
+    def publish(self, msg):
+        """Queue a message for all observers. Safe to call from the game thread."""
+        loop = self.loop
+        if loop is None:
+            return
+        self._pending.put(msg)
+
+    def _wake(self):
+        self.loop.call_soon_threadsafe(self._drain)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(asyncio.start_server(self._serve, self.host, self.port))
+        except OSError as e:
+            print(f"spectator: cannot listen on {self.host}:{self.port}: {e}", file=sys.stderr)
+            self.loop = None
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    async def _serve(self, reader, writer):
+        obs = _Observer(writer, asyncio.Queue(self.queue_size))
+        obs.queue.put_nowait(self._snapshot())
+        self.observers.add(obs)
+        try:
+            while True:
+                line = await obs.queue.get()
+                writer.write(line)
+                # backpressure: while the socket buffer is full this waits and the
+                # observer's queue fills up instead (see _fanout)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.observers.discard(obs)
+            writer.close()
+
+    def _snapshot(self):
+        if self._snapshot_line is None:
+            self._snapshot_line = self._encode(self.view)
+        return self._snapshot_line
+
+    @staticmethod
+    def _encode(msg):
+        return (json.dumps(msg, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _apply(self, msg):
+        kind = msg['t']
+        view = self.view
+        if kind == 'snapshot':
+            self.view = msg
+        elif kind == 'move':
+            i = msg['x'] * view['h'] + msg['y']
+            view['tops'][i] = msg['top']
+            view['heights'][i] = msg['height']
+            preview = view['preview']
+            preview.append(msg['push'])
+            if msg['elim']:
+                del preview[-3 * msg['elim']:]
+            view['score'] = msg['score']
+        elif kind == 'timer':
+            view['remaining'] = msg['remaining']
+        elif kind == 'state':
+            view['state'] = msg['state']
+            view['overlay'] = msg['overlay']
+        self._snapshot_line = None
+
+    def _drain(self):
+        self._pending.drain(self._fanout)
+
+    def _fanout(self, msg):
+        self._apply(msg)
+        if not self.observers:
+            return
+        line = self._encode(msg)
+        for obs in self.observers:
+            try:
+                obs.queue.put_nowait(line)
+            except asyncio.QueueFull:
+                # slow observer: drop its backlog and resync from the current view
+                while not obs.queue.empty():
+                    obs.queue.get_nowait()
+                obs.queue.put_nowait(self._snapshot())
+                obs.resyncs += 1
@@ -0,0 +1,162 @@
+"""Per-level gameplay telemetry: counters and histograms kept in plain slotted
+objects so that recording an event is an attribute increment or a bisect, and
+exported on demand as a Prometheus text-file (node_exporter textfile collector)
+and as JSON.
+"""
+import json
+import os
+from bisect import bisect_left
+
+
+PREFIX = 'match3'
+
+# histogram bucket upper bounds (the +Inf bucket is implicit)
+CASCADE_BUCKETS = (1, 2, 3, 4, 6, 8)
+SECONDS_BUCKETS = (5, 10, 20, 30, 45, 60, 75, 90, 100, 120, 180)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'buckets', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        out = []
+        for n in self.buckets:
+            total += n
+            out.append(total)
+        return out
+
+    def to_dict(self):
+        return {'bounds': list(self.bounds), 'buckets': list(self.buckets), 'sum': self.sum, 'count': self.count}
+
+
+class LevelStats:
+    """Everything recorded for one level; the game updates the fields directly."""
+
+    __slots__ = ('starts', 'clicks', 'eliminations', 'cascades', 'undos', 'shuffles',
+                 'preview_max', 'seconds')
+
+    def __init__(self):
+        self.starts = 0
+        self.clicks = 0
+        self.eliminations = 0  # triples removed
+        self.cascades = Histogram(CASCADE_BUCKETS)  # triples removed per move that eliminated
+        self.undos = 0
+        self.shuffles = 0
+        self.preview_max = 0
+        self.seconds = {}  # 'cleared' / game-over reason -> Histogram of time to clear or fail
+
+    def finish(self, outcome, seconds):
+        hist = self.seconds.get(outcome)
+        if hist is None:
+            hist = self.seconds[outcome] = Histogram(SECONDS_BUCKETS)
+        hist.observe(seconds)
+
+    def to_dict(self):
+        return {
+            'starts': self.starts, 'clicks': self.clicks, 'eliminations': self.eliminations,
+            'cascade_length': self.cascades.to_dict(), 'undos': self.undos, 'shuffles': self.shuffles,
+            'preview_max': self.preview_max, 'outcomes': {k: h.count for k, h in self.seconds.items()},
+            'level_seconds': {k: h.to_dict() for k, h in self.seconds.items()},
+        }
+
+
+class Telemetry:
+    def __init__(self, directory=None, interval=15.0):
+        """Collect per-level stats; if `directory` is set, `maybe_export` writes
+        game_metrics.prom and game_metrics.json there every `interval` seconds."""
+        self.levels = {}
+        # endless-mode runs, by the level whose board they use (label mode="endless")
+        self.endless = {}
+        self.directory = directory
+        self.interval = interval
+        self._last_export = None
+
+    def level(self, level, endless=False):
+        table = self.endless if endless else self.levels
+        stats = table.get(level)
+        if stats is None:
+            stats = table[level] = LevelStats()
+        return stats
+
+    def maybe_export(self, now):
+        if self.directory is None:
+            return
+        if self._last_export is None:
+            self._last_export = now
+        elif now - self._last_export >= self.interval:
+            self._last_export = now
+            self.export()
+
+    def export(self):
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write('game_metrics.prom', self.prometheus())
+            self._write('game_metrics.json', json.dumps(self.to_dict(), indent=1))
+        except OSError:
+            pass
+
+    def _write(self, name, text):
+        # write-then-rename so collectors never read a half-written file
+        path = os.path.join(self.directory, name)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def to_dict(self):
+        return {'levels': {str(level): s.to_dict() for level, s in sorted(self.levels.items())},
+                'endless': {str(level): s.to_dict() for level, s in sorted(self.endless.items())}}
+
+    def prometheus(self):
+        levels = [(f'level="{lv}"', s) for lv, s in sorted(self.levels.items())]
+        levels += [(f'level="{lv}",mode="endless"', s) for lv, s in sorted(self.endless.items())]
+        lines = []
+
+        def metric(name, kind, help_text, rows):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in rows:
+                lines.append(f"{PREFIX}_{name}{{{labels}}} {value}")
+
+        def histogram(name, help_text, rows):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for labels, hist in rows:
+                for bound, total in zip(list(hist.bounds) + ['+Inf'], hist.cumulative()):
+                    lines.append(f'{PREFIX}_{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f"{PREFIX}_{name}_sum{{{labels}}} {hist.sum}")
+                lines.append(f"{PREFIX}_{name}_count{{{labels}}} {hist.count}")
+
+        metric('level_starts_total', 'counter', 'Times the level was started.',
+               [(labels, s.starts) for labels, s in levels])
+        metric('clicks_total', 'counter', 'Tiles moved to the preview.',
+               [(labels, s.clicks) for labels, s in levels])
+        metric('eliminations_total', 'counter', 'Triples eliminated from the preview.',
+               [(labels, s.eliminations) for labels, s in levels])
+        metric('undos_total', 'counter', 'Undo uses.',
+               [(labels, s.undos) for labels, s in levels])
+        metric('shuffles_total', 'counter', 'Shuffle uses.',
+               [(labels, s.shuffles) for labels, s in levels])
+        metric('preview_max', 'gauge', 'Longest preview seen.',
+               [(labels, s.preview_max) for labels, s in levels])
+        metric('level_outcomes_total', 'counter', 'Level endings by outcome (cleared or game-over reason).',
+               [(f'{labels},outcome="{o}"', h.count) for labels, s in levels for o, h in sorted(s.seconds.items())])
+        histogram('cascade_length', 'Triples removed by a single move.',
+                  [(labels, s.cascades) for labels, s in levels])
+        histogram('level_seconds', 'Time to clear or fail the level.',
+                  [(f'{labels},outcome="{o}"', h) for labels, s in levels for o, h in sorted(s.seconds.items())])
+        return '\n'.join(lines) + '\n'